@@ -1,34 +1,45 @@
 # Production Database Configuration with Connection Pooling
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import ConnectionFailure, OperationFailure, ServerSelectionTimeoutError
+import cachetools
 import os
 import logging
-from typing import Optional
+from typing import Any, Awaitable, Callable, Optional
 
 logger = logging.getLogger(__name__)
 
+# Connection pool bounds, sized for bursty auth traffic
+MAX_POOL_SIZE = 200
+MIN_POOL_SIZE = 5
+
+# Login only ever looks up active users
+ACTIVE_USERS_FILTER = {"is_active": True}
+
 class DatabaseManager:
-    """Production-ready MongoDB connection manager with pooling"""
+    """Production-ready async MongoDB connection manager with pooling"""
     
     def __init__(self):
-        self.client: Optional[MongoClient] = None
+        self.client: Optional[AsyncIOMotorClient] = None
         self.db = None
         self.users_collection = None
         
-    def connect(self) -> bool:
+        # Admin command results are expensive, reuse them for 30 seconds
+        self._stats_cache = cachetools.TTLCache(maxsize=8, ttl=30)
+        
+    async def connect(self) -> bool:
         """Establish MongoDB connection with production settings"""
         try:
             # Production MongoDB connection with pooling
-            self.client = MongoClient(
+            self.client = AsyncIOMotorClient(
                 os.getenv("MONGODB_URL"),
-                maxPoolSize=50,  # Maximum connections in pool
-                minPoolSize=10,  # Minimum connections in pool
-                maxIdleTimeMS=30000,  # Close connections after 30 seconds of inactivity
-                waitQueueTimeoutMS=5000,  # Wait 5 seconds for connection from pool
+                maxPoolSize=MAX_POOL_SIZE,  # Maximum connections in pool
+                minPoolSize=MIN_POOL_SIZE,  # Minimum connections, driver grows on demand
+                maxConnecting=4,  # Limit concurrent connection handshakes
+                maxIdleTimeMS=300000,  # Close connections after 5 minutes of inactivity
+                waitQueueTimeoutMS=2000,  # Wait 2 seconds for connection from pool
                 serverSelectionTimeoutMS=5000,  # Server selection timeout
                 connectTimeoutMS=10000,  # Connection timeout
                 socketTimeoutMS=20000,  # Socket timeout
-                heartbeatFrequencyMS=10000,  # Heartbeat frequency
                 retryWrites=True,  # Enable retryable writes
                 readPreference='primary',  # Read from primary for consistency
                 readConcern={'level': 'majority'},  # Read concern for consistency
@@ -36,14 +47,14 @@ class DatabaseManager:
             )
             
             # Test connection
-            self.client.admin.command('ping')
+            await self.client.admin.command('ping')
             
             # Set up database and collection
             self.db = self.client[os.getenv("DATABASE_NAME")]
             self.users_collection = self.db[os.getenv("COLLECTION_NAME")]
             
             # Create indexes for performance
-            self._create_indexes()
+            await self._create_indexes()
             
             logger.info("✅ Connected to MongoDB with production settings")
             return True
@@ -55,52 +66,89 @@ class DatabaseManager:
             logger.error(f"❌ Unexpected database error: {e}")
             return False
     
-    def _create_indexes(self):
+    async def _create_indexes(self):
         """Create database indexes for performance"""
         try:
-            # Index on email for fast user lookup
-            self.users_collection.create_index([("email", 1)], unique=True)
+            # Drop the old full email index. The partial index below only
+            # serves queries that also filter is_active: true, so email-only
+            # lookups (including inactive users) are no longer indexed.
+            await self._drop_stale_index("email_1")
+            await self._drop_stale_index("email_1_is_active_1", ACTIVE_USERS_FILTER)
             
-            # Compound index on email and is_active for login queries
-            self.users_collection.create_index([("email", 1), ("is_active", 1)])
+            # Partial compound index on active users, serves login queries
+            await self.users_collection.create_index(
+                [("email", 1), ("is_active", 1)],
+                unique=True,
+                partialFilterExpression=ACTIVE_USERS_FILTER
+            )
             
             # Index on last_login for analytics
-            self.users_collection.create_index([("last_login", -1)])
+            await self.users_collection.create_index([("last_login", -1)])
             
             # Index on created_at for user management
-            self.users_collection.create_index([("created_at", -1)])
+            await self.users_collection.create_index([("created_at", -1)])
             
             logger.info("✅ Database indexes created successfully")
             
         except Exception as e:
             logger.warning(f"⚠️ Failed to create indexes: {e}")
     
-    def get_connection_info(self) -> dict:
+    async def _drop_stale_index(self, name: str, partial_filter: Optional[dict] = None):
+        """Drop an index if it exists, unless it already uses partial_filter"""
+        existing = (await self.users_collection.index_information()).get(name)
+        if existing is None:
+            return
+        if partial_filter is None or existing.get("partialFilterExpression") != partial_filter:
+            await self.users_collection.drop_index(name)
+            logger.info(f"Dropped outdated index: {name}")
+    
+    async def get_connection_info(self) -> dict:
         """Get connection status and statistics"""
         if not self.client:
             return {"connected": False}
         
         try:
-            server_info = self.client.server_info()
-            db_stats = self.db.command("dbStats")
+            server_info = await self._cached_stat("server_info", self.client.server_info)
+            db_stats = await self._cached_stat("db_stats", lambda: self.db.command("dbStats"))
+            server_status = await self._cached_stat("server_status", self._server_status)
+            
+            user_count = await self.users_collection.count_documents({})
             
             return {
                 "connected": True,
                 "server_version": server_info.get("version"),
                 "database_name": self.db.name,
                 "collection_name": self.users_collection.name,
-                "user_count": self.users_collection.count_documents({}),
+                "user_count": user_count,
                 "database_size_mb": round(db_stats.get("dataSize", 0) / 1024 / 1024, 2),
                 "pool_size": {
-                    "max": 50,
-                    "min": 10,
-                    "current": len(self.client._topology._pool._sockets) if hasattr(self.client, '_topology') else "N/A"
-                }
+                    "max": MAX_POOL_SIZE,
+                    "min": MIN_POOL_SIZE
+                },
+                # Server-wide count across all clients, not just this pool
+                "server_connections": server_status.get("connections", {}).get("current", "N/A")
             }
         except Exception as e:
             logger.error(f"Error getting connection info: {e}")
             return {"connected": True, "error": str(e)}
     
+    async def _cached_stat(self, name: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """Return a cached admin command result, fetching it when stale"""
+        value = self._stats_cache.get(name)
+        if value is None:
+            value = await fetch()
+            self._stats_cache[name] = value
+        return value
+    
+    async def _server_status(self) -> dict:
+        """Run serverStatus, which needs the clusterMonitor role"""
+        try:
+            return await self.client.admin.command("serverStatus")
+        except OperationFailure as e:
+            # Cache the empty result too, so an unauthorized user isn't retried per call
+            logger.warning(f"serverStatus unavailable: {e}")
+            return {}
+    
     def close_connection(self):
         """Close MongoDB connection"""
         if self.client:
@@ -1,51 +1,207 @@
 # Production Security Configuration
 from fastapi import HTTPException, Request, status
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import jwt
 import bcrypt
+import asyncio
 import hashlib
+import multiprocessing
 import secrets
+import threading
 import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta
-from typing import Dict, Optional
+from typing import Optional, Tuple
 import logging
 import redis
+import cachetools
 import os
 
 logger = logging.getLogger(__name__)
 
+def _available_cpus() -> int:
+    """CPUs this process may run on, honouring affinity unlike os.cpu_count()"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+# Sliding-window rate limit check, executed atomically in a single round trip.
+# Returns 0 if the request is allowed, otherwise milliseconds until a slot frees up.
+RATE_LIMIT_LUA = """
+local k = KEYS[1]
+local now = tonumber(ARGV[1])
+local win = tonumber(ARGV[2])
+local lim = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', k, 0, now - win)
+local c = redis.call('ZCARD', k)
+if c >= lim then
+  local oldest = redis.call('ZRANGE', k, 0, 0, 'WITHSCORES')
+  local retry = win
+  if oldest[2] then retry = tonumber(oldest[2]) + win - now end
+  return math.ceil(retry * 1000)
+end
+redis.call('ZADD', k, now, ARGV[1])
+redis.call('PEXPIRE', k, math.ceil(win * 1000))
+return 0
+"""
+
+# Blacklist check followed by the sliding-window check, in one round trip.
+# KEYS[1] is the rate-limit key, KEYS[2] the blacklist key. Returns -1 for a
+# revoked token without counting the request, otherwise as RATE_LIMIT_LUA.
+REQUEST_CHECK_LUA = """
+if redis.call('EXISTS', KEYS[2]) == 1 then return -1 end
+""" + RATE_LIMIT_LUA
+
+# Fixed-window counter: O(1) memory per identifier, returns the bucket count.
+FIXED_WINDOW_LUA = """
+local c = redis.call('INCR', KEYS[1])
+if c == 1 then redis.call('EXPIRE', KEYS[1], ARGV[1]) end
+return c
+"""
+
 class SecurityManager:
     """Production security manager with rate limiting and token management"""
     
-    def __init__(self):
+    def __init__(self, redis_client: Optional[redis.Redis] = None):
+        # JWT settings, resolved once so a missing secret fails at startup
+        self._jwt_secret = os.environ["JWT_SECRET"]
+        self._jwt_alg = os.environ.get("JWT_ALGORITHM", "HS256")
+        self._jwt_algorithms = [self._jwt_alg]
+        self._iss = "supply-chain-ai"  # Issuer
+        self._aud = "supply-chain-ai-frontend"  # Audience
+        
+        # bcrypt cost for new hashes; existing hashes keep their own cost
+        self._bcrypt_rounds = int(os.environ.get("BCRYPT_ROUNDS", "10"))
+        
+        # bcrypt is CPU-bound, checks run on a process pool created by start()
+        self._bcrypt_workers = int(os.environ.get("BCRYPT_WORKERS") or _available_cpus())
+        self._bcrypt_pool: Optional[ProcessPoolExecutor] = None
+        
         # Redis connection for rate limiting and token blacklist
         self.redis_client = None
+        self._rl_script = None
+        self._rl_fast_script = None
+        self._request_script = None
         try:
-            self.redis_client = redis.Redis(
+            self.redis_client = redis_client or redis.Redis(
                 host=os.getenv("REDIS_HOST", "redis"),
                 port=int(os.getenv("REDIS_PORT", "6379")),
                 db=0,
                 decode_responses=True
             )
             self.redis_client.ping()
+            self._rl_script = self.redis_client.register_script(RATE_LIMIT_LUA)
+            self._rl_fast_script = self.redis_client.register_script(FIXED_WINDOW_LUA)
+            self._request_script = self.redis_client.register_script(REQUEST_CHECK_LUA)
             logger.info("✅ Connected to Redis for security features")
         except Exception as e:
             logger.warning(f"⚠️ Redis not available, using in-memory fallback: {e}")
             self.redis_client = None
         
-        # In-memory fallback for rate limiting
-        self.rate_limit_cache: Dict[str, list] = {}
-        self.token_blacklist: set = set()
+        # In-memory fallback for rate limiting and token blacklist, bounded so
+        # unique IPs or tokens cannot grow them without limit
+        # Entries are (timestamps, window_seconds) and live for one window
+        # after the last check, so day-scale limits keep their history
+        self.rate_limit_cache = cachetools.TLRUCache(
+            maxsize=100_000,
+            ttu=lambda _identifier, entry, now: now + entry[1],
+            timer=time.time
+        )
+        # Blacklisted token jti values, each evicted when its token expires
+        self.token_blacklist = cachetools.TLRUCache(
+            maxsize=1_000_000,
+            ttu=lambda _jti, exp_timestamp, _now: exp_timestamp,
+            timer=time.time
+        )
+        self._fallback_lock = threading.Lock()
+        
+        # Short-lived cache of verified token payloads, keyed by token hash
+        self._verified_tokens = cachetools.TTLCache(maxsize=50_000, ttl=60)
+        self._verified_tokens_lock = threading.Lock()
+        
+        # Recently failed (email, password) pairs, so repeated guesses skip bcrypt
+        self._bad_cred_cache = cachetools.TTLCache(maxsize=100_000, ttl=30)
+        
+        # Limiters known to be over their Redis rate limit, cached until the
+        # window frees up so repeat requests skip the Redis round trip. Keyed
+        # by (kind, identifier, limit, window); values are absolute expiry times.
+        self._rl_blocked = cachetools.TLRUCache(
+            maxsize=100_000,
+            ttu=lambda _key, expires_at, _now: expires_at,
+            timer=time.time
+        )
+        self._rl_blocked_lock = threading.Lock()
     
     def hash_password(self, password: str) -> str:
         """Hash password with bcrypt"""
-        salt = bcrypt.gensalt()
+        salt = bcrypt.gensalt(rounds=self._bcrypt_rounds)
         return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
     
     def verify_password(self, password: str, hashed: str) -> bool:
         """Verify password against hash"""
         return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
     
+    async def verify_password_async(self, password: str, hashed: str) -> bool:
+        """Verify password against hash without blocking the event loop"""
+        password_bytes = password.encode('utf-8')
+        hashed_bytes = hashed.encode('utf-8')
+        
+        if self._bcrypt_pool is None:
+            # Not started (e.g. outside the app lifespan), use a thread instead
+            return await asyncio.to_thread(bcrypt.checkpw, password_bytes, hashed_bytes)
+        
+        loop = asyncio.get_running_loop()
+        pool = self._bcrypt_pool
+        try:
+            return await loop.run_in_executor(
+                pool,
+                bcrypt.checkpw,
+                password_bytes,
+                hashed_bytes
+            )
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed) and the pool refuses new work;
+            # replace it unless a concurrent check already did, then retry once
+            if self._bcrypt_pool is pool:
+                logger.warning("bcrypt worker pool broken, restarting it")
+                self.close()
+                self.start()
+            return await loop.run_in_executor(
+                self._bcrypt_pool,
+                bcrypt.checkpw,
+                password_bytes,
+                hashed_bytes
+            )
+    
+    def start(self):
+        """Start background workers"""
+        if self._bcrypt_pool is None:
+            # spawn, not fork: the app process already runs driver and pool threads
+            self._bcrypt_pool = ProcessPoolExecutor(
+                max_workers=self._bcrypt_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+    
+    def close(self):
+        """Release background workers; start() may be called again afterwards"""
+        if self._bcrypt_pool is not None:
+            self._bcrypt_pool.shutdown(wait=False, cancel_futures=True)
+            self._bcrypt_pool = None
+    
+    def _credential_key(self, email: str, password: str) -> bytes:
+        """Build negative-cache key without keeping the plaintext password"""
+        return hashlib.sha256(f"{email}|{password}".encode('utf-8')).digest()
+    
+    def is_known_bad_credential(self, email: str, password: str) -> bool:
+        """Check if this email/password pair recently failed verification"""
+        return self._credential_key(email, password) in self._bad_cred_cache
+    
+    def record_bad_credential(self, email: str, password: str):
+        """Remember a failed email/password pair for a short time"""
+        self._bad_cred_cache[self._credential_key(email, password)] = True
+    
     def generate_secure_token(self) -> str:
         """Generate cryptographically secure token"""
         return secrets.token_urlsafe(32)
@@ -60,79 +216,171 @@ class SecurityManager:
             "iat": now,
             "exp": now + timedelta(hours=expires_hours),
             "jti": self.generate_secure_token(),  # JWT ID for token blacklisting
-            "iss": "supply-chain-ai",  # Issuer
-            "aud": "supply-chain-ai-frontend"  # Audience
+            "iss": self._iss,
+            "aud": self._aud
         }
         
         return jwt.encode(
             payload,
-            os.getenv("JWT_SECRET"),
-            algorithm=os.getenv("JWT_ALGORITHM", "HS256")
+            self._jwt_secret,
+            algorithm=self._jwt_alg
         )
     
     def verify_jwt_token(self, token: str) -> dict:
         """Verify JWT token with blacklist check"""
-        try:
-            # Check if token is blacklisted
-            if self.is_token_blacklisted(token):
+        payload = self._decode_jwt_token(token)
+        
+        # Check if token is blacklisted (keyed on the short jti claim)
+        if self.is_token_blacklisted(payload.get("jti")):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Token has been revoked"
+            )
+        
+        return payload
+    
+    def check_request(self, token: str, identifier: str, limit: int, window_seconds: int) -> dict:
+        """Verify JWT token, blacklist and rate limit in a single Redis round trip.
+        
+        Revoked tokens get 401 before any rate limit applies and are not
+        counted against the caller's quota.
+        """
+        payload = self._decode_jwt_token(token)
+        jti = payload.get("jti")
+        
+        if not self.redis_client:
+            if self.is_token_blacklisted(jti):
                 raise HTTPException(
                     status_code=status.HTTP_401_UNAUTHORIZED,
                     detail="Token has been revoked"
                 )
-            
-            payload = jwt.decode(
-                token,
-                os.getenv("JWT_SECRET"),
-                algorithms=[os.getenv("JWT_ALGORITHM", "HS256")],
-                audience="supply-chain-ai-frontend",
-                issuer="supply-chain-ai"
-            )
-            
+            if not self.check_rate_limit(identifier, limit, window_seconds):
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Rate limit exceeded"
+                )
             return payload
-            
+        
+        block_key = ("sliding", identifier, limit, window_seconds)
+        if self._is_rate_limit_blocked(block_key):
+            # Rate limit known locally, only the blacklist needs Redis
+            if self.is_token_blacklisted(jti):
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail="Token has been revoked"
+                )
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Rate limit exceeded"
+            )
+        
+        try:
+            retry_after_ms = self._request_script(
+                keys=[f"rate_limit:{identifier}", f"bl:{jti or ''}"],
+                args=[time.time(), window_seconds, limit]
+            )
+        except Exception as e:
+            logger.error(f"Redis request check error: {e}")
+            return payload  # Allow request on Redis error
+        
+        if retry_after_ms < 0:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Token has been revoked"
+            )
+        if retry_after_ms:
+            self._block_rate_limit(block_key, retry_after_ms / 1000)
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Rate limit exceeded"
+            )
+        
+        return payload
+    
+    def _decode_jwt_token(self, token: str) -> dict:
+        """Decode and verify JWT token, mapping errors to 401 responses"""
+        try:
+            return self._verify_signature_cached(token)
         except jwt.ExpiredSignatureError:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Token has expired"
             )
-        except jwt.JWTError as e:
+        except jwt.InvalidTokenError as e:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail=f"Invalid token: {str(e)}"
             )
     
-    def blacklist_token(self, token: str):
-        """Add token to blacklist"""
-        try:
-            # Get token expiry to set TTL
+    def _verify_signature_cached(self, token: str) -> dict:
+        """Decode and verify token, reusing recently verified payloads"""
+        token_hash = hashlib.blake2b(token.encode('utf-8'), digest_size=16).digest()
+        
+        with self._verified_tokens_lock:
+            payload = self._verified_tokens.get(token_hash)
+        
+        if payload is None:
             payload = jwt.decode(
                 token,
-                os.getenv("JWT_SECRET"),
-                algorithms=[os.getenv("JWT_ALGORITHM", "HS256")],
-                options={"verify_exp": False}
+                self._jwt_secret,
+                algorithms=self._jwt_algorithms,
+                audience=self._aud,
+                issuer=self._iss,
+                # The cache-hit path relies on exp, revocation on jti
+                options={"require": ["exp", "jti"]}
             )
+            with self._verified_tokens_lock:
+                self._verified_tokens[token_hash] = payload
+        elif payload["exp"] <= time.time():
+            # Signature already verified, only expiry can change
+            raise jwt.ExpiredSignatureError("Signature has expired")
+        
+        # Copy so callers can't mutate the cached payload
+        return dict(payload)
+    
+    def blacklist_token(self, token: str):
+        """Add token to blacklist.
+        
+        The token must already have been verified (e.g. via verify_jwt_token),
+        so only its claims are read here without re-checking the signature.
+        """
+        try:
+            # Get token jti and expiry to set TTL
+            payload = jwt.decode(token, options={"verify_signature": False})
+            
+            jti = payload.get("jti")
+            if not jti:
+                logger.warning("Token has no jti claim, cannot blacklist")
+                return
             
             exp_timestamp = payload.get("exp", 0)
             current_timestamp = int(time.time())
-            ttl = max(0, exp_timestamp - current_timestamp)
+            ttl = exp_timestamp - current_timestamp
+            if ttl <= 0:
+                # Already expired, verification rejects it anyway
+                return
             
             if self.redis_client:
-                self.redis_client.setex(f"blacklist:{token}", ttl, "1")
+                self.redis_client.set(f"bl:{jti}", "", ex=ttl, nx=True)
             else:
-                self.token_blacklist.add(token)
+                with self._fallback_lock:
+                    self.token_blacklist[jti] = exp_timestamp
                 
             logger.info("Token blacklisted successfully")
             
         except Exception as e:
             logger.error(f"Failed to blacklist token: {e}")
     
-    def is_token_blacklisted(self, token: str) -> bool:
-        """Check if token is blacklisted"""
+    def is_token_blacklisted(self, jti: Optional[str]) -> bool:
+        """Check if token jti is blacklisted"""
+        if not jti:
+            return False
         try:
             if self.redis_client:
-                return bool(self.redis_client.get(f"blacklist:{token}"))
+                return self.redis_client.exists(f"bl:{jti}") > 0
             else:
-                return token in self.token_blacklist
+                with self._fallback_lock:
+                    return jti in self.token_blacklist
         except Exception:
             return False
     
@@ -140,53 +388,93 @@ class SecurityManager:
         """Check rate limiting with sliding window"""
         current_time = time.time()
         
+        if self._is_rate_limit_blocked(("sliding", identifier, limit, window_seconds)):
+            return False
+        
         if self.redis_client:
             return self._check_rate_limit_redis(identifier, limit, window_seconds, current_time)
         else:
             return self._check_rate_limit_memory(identifier, limit, window_seconds, current_time)
     
+    def check_rate_limit_fast(self, identifier: str, limit: int, window_seconds: int) -> bool:
+        """Check rate limiting with a fixed-window counter.
+        
+        Cheaper than the sliding window for high limits; keep check_rate_limit
+        for small, security-critical limits such as login attempts.
+        """
+        current_time = time.time()
+        block_key = ("fixed", identifier, limit, window_seconds)
+        
+        if self._is_rate_limit_blocked(block_key):
+            return False
+        
+        if not self.redis_client:
+            # Own namespace so sliding-window hits for the same identifier don't count
+            return self._check_rate_limit_memory(f"rl:{identifier}", limit, window_seconds, current_time)
+        
+        try:
+            key = f"rl:{identifier}:{int(current_time // window_seconds)}"
+            count = self._rl_fast_script(keys=[key], args=[window_seconds])
+            if count > limit:
+                # Blocked until the current bucket rolls over
+                self._block_rate_limit(block_key, window_seconds - (current_time % window_seconds))
+                return False
+            return True
+            
+        except Exception as e:
+            logger.error(f"Redis rate limiting error: {e}")
+            return True  # Allow request on Redis error
+    
     def _check_rate_limit_redis(self, identifier: str, limit: int, window_seconds: int, current_time: float) -> bool:
         """Redis-based rate limiting"""
         try:
             key = f"rate_limit:{identifier}"
-            
-            # Remove old entries
-            self.redis_client.zremrangebyscore(key, 0, current_time - window_seconds)
-            
-            # Count current requests
-            current_requests = self.redis_client.zcard(key)
-            
-            if current_requests >= limit:
+            retry_after_ms = self._rl_script(keys=[key], args=[current_time, window_seconds, limit])
+            if retry_after_ms:
+                self._block_rate_limit(
+                    ("sliding", identifier, limit, window_seconds),
+                    retry_after_ms / 1000
+                )
                 return False
-            
-            # Add current request
-            self.redis_client.zadd(key, {str(current_time): current_time})
-            self.redis_client.expire(key, window_seconds)
-            
             return True
             
         except Exception as e:
             logger.error(f"Redis rate limiting error: {e}")
             return True  # Allow request on Redis error
     
+    def _is_rate_limit_blocked(self, block_key: Tuple[str, str, int, int]) -> bool:
+        """Check the in-process cache of limiters over their limit"""
+        with self._rl_blocked_lock:
+            return block_key in self._rl_blocked
+    
+    def _block_rate_limit(self, block_key: Tuple[str, str, int, int], seconds: float):
+        """Remember that a (kind, identifier, limit, window) limiter is exhausted"""
+        with self._rl_blocked_lock:
+            self._rl_blocked[block_key] = time.time() + seconds
+    
     def _check_rate_limit_memory(self, identifier: str, limit: int, window_seconds: int, current_time: float) -> bool:
         """Memory-based rate limiting fallback"""
-        if identifier not in self.rate_limit_cache:
-            self.rate_limit_cache[identifier] = []
-        
-        # Remove old entries
-        self.rate_limit_cache[identifier] = [
-            timestamp for timestamp in self.rate_limit_cache[identifier]
-            if current_time - timestamp < window_seconds
-        ]
-        
-        # Check limit
-        if len(self.rate_limit_cache[identifier]) >= limit:
-            return False
-        
-        # Add current request
-        self.rate_limit_cache[identifier].append(current_time)
-        return True
+        with self._fallback_lock:
+            entry = self.rate_limit_cache.get(identifier)
+            timestamps = entry[0] if entry else None
+            if timestamps is None or timestamps.maxlen != limit:
+                # Bounded ring buffer of request times, oldest first
+                timestamps = deque(timestamps or (), maxlen=limit)
+            
+            # Re-insert on every check so the entry outlives its newest timestamp
+            self.rate_limit_cache[identifier] = (timestamps, window_seconds)
+            
+            # Remove old entries
+            while timestamps and current_time - timestamps[0] >= window_seconds:
+                timestamps.popleft()
+            
+            # Check limit
+            if len(timestamps) >= limit:
+                return False
+            
+            # Add current request
+            timestamps.append(current_time)
+            return True
     
     def get_client_ip(self, request: Request) -> str:
         """Get client IP address with proxy support"""
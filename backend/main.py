@@ -2,22 +2,22 @@ from fastapi import FastAPI, HTTPException, Depends, status, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, EmailStr
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
-import bcrypt
-import jwt
-from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from bson import ObjectId
+from bson.errors import InvalidId
+from datetime import datetime
 import os
 from dotenv import load_dotenv
 import logging
 from typing import Optional
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
-from config.database import db_manager
-from config.security import security_manager
 
-# Load environment variables
+# Load environment variables before config modules read them
 load_dotenv()
 
+from config.database import DatabaseManager, db_manager
+from config.security import SecurityManager, security_manager
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -44,17 +44,11 @@ app.add_middleware(
 )
 
 # Environment variables
-MONGODB_URL = os.getenv("MONGODB_URL")
-DATABASE_NAME = os.getenv("DATABASE_NAME") 
-COLLECTION_NAME = os.getenv("COLLECTION_NAME")
-JWT_SECRET = os.getenv("JWT_SECRET")
-JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 JWT_EXPIRES_IN_HOURS = int(os.getenv("JWT_EXPIRES_IN_HOURS", "24"))
 
-# MongoDB client
-client = None
-db = None
-users_collection = None
+# Fields each auth query actually reads, to keep BSON payloads small
+LOGIN_PROJECTION = {"_id": 1, "email": 1, "name": 1, "role": 1, "password_hash": 1}
+REFRESH_PROJECTION = {"_id": 1, "email": 1, "name": 1, "role": 1}
 
 # Security
 security = HTTPBearer()
@@ -80,80 +74,71 @@ class ConnectionTestResponse(BaseModel):
     success: bool
     message: str
 
-# Database connection
-def connect_to_mongodb():
-    global client, db, users_collection
-    try:
-        client = MongoClient(MONGODB_URL)
-        # Test the connection
-        client.admin.command('ping')
-        db = client[DATABASE_NAME]
-        users_collection = db[COLLECTION_NAME]
-        logger.info(f"✅ Connected to MongoDB: {DATABASE_NAME}.{COLLECTION_NAME}")
-        return True
-    except ConnectionFailure as e:
-        logger.error(f"❌ MongoDB connection failed: {e}")
-        return False
-
-# Initialize database connection on startup
+# Initialize pooled database connection on startup
 @app.on_event("startup")
 async def startup_event():
-    if not connect_to_mongodb():
+    security_manager.start()
+    if not await db_manager.connect():
         logger.error("Failed to connect to MongoDB on startup")
 
-# JWT token functions
-def create_jwt_token(user_data: dict) -> str:
-    """Create JWT token for authenticated user"""
-    payload = {
-        "user_id": str(user_data["_id"]),
-        "email": user_data["email"],
-        "role": user_data["role"],
-        "exp": datetime.utcnow() + timedelta(hours=JWT_EXPIRES_IN_HOURS),
-        "iat": datetime.utcnow()
-    }
-    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+@app.on_event("shutdown")
+async def shutdown_event():
+    db_manager.close_connection()
+    security_manager.close()
 
-def verify_jwt_token(token: str) -> dict:
-    """Verify and decode JWT token"""
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        return payload
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Token has expired"
-        )
-    except jwt.JWTError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid token"
-        )
+# Dependencies
+def get_security_manager() -> SecurityManager:
+    """Shared security manager, resolved once per request"""
+    return security_manager
+
+def get_db_manager() -> DatabaseManager:
+    """Shared database manager, resolved once per request"""
+    return db_manager
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    security_mgr: SecurityManager = Depends(get_security_manager)
+):
     """Get current user from JWT token"""
-    token = credentials.credentials
-    payload = verify_jwt_token(token)
-    return payload
+    return security_mgr.verify_jwt_token(credentials.credentials)
 
 # Authentication endpoints
 @app.post("/api/auth/login", response_model=LoginResponse)
-async def login(request: LoginRequest):
+async def login(
+    request: LoginRequest,
+    security_mgr: SecurityManager = Depends(get_security_manager),
+    db_mgr: DatabaseManager = Depends(get_db_manager)
+):
     """Authenticate user with email and password"""
     try:
         logger.info(f"🔐 Login attempt for email: {request.email}")
         
-        if not users_collection:
+        users_collection = db_mgr.users_collection
+        if users_collection is None:
             logger.error("Database connection not available")
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Database connection error"
             )
 
-        # Find user in MongoDB
-        user = users_collection.find_one({
-            "email": request.email,
-            "is_active": True
-        })
+        # Short-circuit repeated wrong guesses before DB lookup and bcrypt
+        if security_mgr.is_known_bad_credential(request.email, request.password):
+            logger.warning(f"Repeated invalid credentials for user: {request.email}")
+            return LoginResponse(
+                success=False,
+                message="Invalid email or password"
+            )
+
+        # Find user and update last login in a single round trip. The stamp
+        # is written before the password check, so last_login records every
+        # password attempt against an active account, not only successful ones.
+        now = datetime.utcnow()
+        user = await users_collection.find_one_and_update(
+            {"email": request.email, "is_active": True},
+            {"$set": {"last_login": now, "updated_at": now}},
+            projection=LOGIN_PROJECTION,
+            return_document=ReturnDocument.BEFORE
+        )
 
         if not user:
             logger.warning(f"User not found or inactive: {request.email}")
@@ -162,27 +147,17 @@ async def login(request: LoginRequest):
                 message="Invalid email or password"
             )
 
-        # Verify password
-        if not bcrypt.checkpw(request.password.encode('utf-8'), user["password_hash"].encode('utf-8')):
+        # Verify password on the bcrypt process pool
+        if not await security_mgr.verify_password_async(request.password, user["password_hash"]):
             logger.warning(f"Invalid password for user: {request.email}")
+            security_mgr.record_bad_credential(request.email, request.password)
             return LoginResponse(
                 success=False,
                 message="Invalid email or password"
             )
 
-        # Update last login
-        users_collection.update_one(
-            {"_id": user["_id"]},
-            {
-                "$set": {
-                    "last_login": datetime.utcnow(),
-                    "updated_at": datetime.utcnow()
-                }
-            }
-        )
-
         # Create JWT token
-        token = create_jwt_token(user)
+        token = security_mgr.create_jwt_token(user, expires_hours=JWT_EXPIRES_IN_HOURS)
 
         # Prepare user response
         user_response = {
@@ -209,20 +184,20 @@ async def login(request: LoginRequest):
         )
 
 @app.post("/api/auth/test-connection", response_model=ConnectionTestResponse)
-async def test_connection():
+async def test_connection(db_mgr: DatabaseManager = Depends(get_db_manager)):
     """Test database connection"""
     try:
-        if not client:
+        if db_mgr.client is None:
             return ConnectionTestResponse(
                 success=False,
                 message="Database client not initialized"
             )
         
         # Ping database
-        client.admin.command('ping')
+        await db_mgr.client.admin.command('ping')
         
         # Test collection access
-        count = users_collection.count_documents({})
+        count = await db_mgr.users_collection.count_documents({})
         
         logger.info("✅ Database connection test successful")
         return ConnectionTestResponse(
@@ -251,14 +226,27 @@ async def verify_token(current_user: dict = Depends(get_current_user)):
     }
 
 @app.get("/api/auth/refresh-token")
-async def refresh_token(current_user: dict = Depends(get_current_user)):
+async def refresh_token(
+    current_user: dict = Depends(get_current_user),
+    security_mgr: SecurityManager = Depends(get_security_manager),
+    db_mgr: DatabaseManager = Depends(get_db_manager)
+):
     """Refresh JWT token"""
     try:
+        # user_id is the stringified ObjectId, convert back to hit the _id index
+        try:
+            user_id = ObjectId(current_user["user_id"])
+        except (InvalidId, TypeError):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid user id in token"
+            )
+
         # Get user from database to ensure they're still active
-        user = users_collection.find_one({
-            "_id": current_user["user_id"],
-            "is_active": True
-        })
+        user = await db_mgr.users_collection.find_one(
+            {"_id": user_id, "is_active": True},
+            projection=REFRESH_PROJECTION
+        )
         
         if not user:
             raise HTTPException(
@@ -267,7 +255,7 @@ async def refresh_token(current_user: dict = Depends(get_current_user)):
             )
         
         # Create new token
-        new_token = create_jwt_token(user)
+        new_token = security_mgr.create_jwt_token(user, expires_hours=JWT_EXPIRES_IN_HOURS)
         
         return {
             "success": True,
@@ -275,6 +263,8 @@ async def refresh_token(current_user: dict = Depends(get_current_user)):
             "token": new_token
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Token refresh error: {str(e)}")
         raise HTTPException(
@@ -284,12 +274,12 @@ async def refresh_token(current_user: dict = Depends(get_current_user)):
 
 # Health check endpoint
 @app.get("/health")
-async def health_check():
+async def health_check(db_mgr: DatabaseManager = Depends(get_db_manager)):
     """Health check endpoint"""
     return {
         "status": "healthy",
         "timestamp": datetime.utcnow().isoformat(),
-        "database_connected": client is not None
+        "database_connected": db_mgr.client is not None
     }
 
 # Root endpoint
@@ -4,6 +4,7 @@ import asyncio
 from fastapi.testclient import TestClient
 from main import app
 import os
+from typing import Optional
 
 # Test client
 client = TestClient(app)
@@ -23,6 +24,31 @@ def event_loop():
     yield loop
     loop.close()
 
+@pytest.fixture
+def memory_security():
+    """Fresh security manager using the in-memory fallbacks"""
+    from config.security import SecurityManager
+    
+    manager = SecurityManager()
+    manager.redis_client = None
+    return manager
+
+@pytest.fixture
+def redis_security():
+    """Fresh security manager backed by an in-process fake Redis"""
+    import fakeredis
+    from config.security import SecurityManager
+    
+    return SecurityManager(redis_client=fakeredis.FakeRedis(decode_responses=True))
+
+def issue_token(manager, user_id: str = "test_id") -> str:
+    """Create a token for the test user with the given security manager"""
+    return manager.create_jwt_token({
+        "_id": user_id,
+        "email": TEST_USER["email"],
+        "role": TEST_USER["role"]
+    })
+
 class TestAuthentication:
     """Test authentication endpoints"""
     
@@ -101,6 +127,360 @@ class TestSecurity:
         assert security_manager.verify_password(password, hashed)  # Should verify correctly
         assert not security_manager.verify_password("wrongpassword", hashed)  # Wrong password should fail
 
+    def test_password_pool_restarts_after_close(self):
+        """Test bcrypt pool survives a second app lifespan"""
+        from config.security import SecurityManager
+        
+        manager = SecurityManager()
+        hashed = manager.hash_password("testpassword123")
+        
+        async def verify_twice():
+            for _ in range(2):
+                manager.start()
+                try:
+                    assert await manager.verify_password_async("testpassword123", hashed)
+                    assert not await manager.verify_password_async("wrongpassword", hashed)
+                finally:
+                    manager.close()
+        
+        asyncio.run(verify_twice())
+    
+    def test_password_pool_recovers_from_killed_worker(self):
+        """Test a dead bcrypt worker does not break later verifications"""
+        import signal
+        from config.security import SecurityManager
+        
+        manager = SecurityManager()
+        hashed = manager.hash_password("testpassword123")
+        
+        async def verify_after_kill():
+            manager.start()
+            try:
+                assert await manager.verify_password_async("testpassword123", hashed)
+                
+                broken_pool = manager._bcrypt_pool
+                for pid in list(broken_pool._processes):
+                    os.kill(pid, signal.SIGKILL)
+                
+                assert await manager.verify_password_async("testpassword123", hashed)
+                assert manager._bcrypt_pool is not broken_pool
+            finally:
+                manager.close()
+        
+        asyncio.run(verify_after_kill())
+    
+    def test_token_blacklisting(self):
+        """Test revoked tokens are rejected by jti"""
+        from fastapi import HTTPException
+        from config.security import security_manager
+
+        token = issue_token(security_manager)
+        payload = security_manager.verify_jwt_token(token)
+        assert not security_manager.is_token_blacklisted(payload["jti"])
+
+        security_manager.blacklist_token(token)
+        assert security_manager.is_token_blacklisted(payload["jti"])
+
+        with pytest.raises(HTTPException) as exc_info:
+            security_manager.verify_jwt_token(token)
+        assert exc_info.value.detail == "Token has been revoked"
+
+class TestVerifiedTokenCache:
+    """Test the verified-payload cache keeps expiry and revocation checks"""
+    
+    def _cached_token(self, manager, monkeypatch):
+        """Issue and verify a token, then forbid further signature checks"""
+        import jwt
+        
+        token = issue_token(manager)
+        payload = manager.verify_jwt_token(token)
+        
+        def fail_decode(*args, **kwargs):
+            raise AssertionError("cache hit expected, token decoded again")
+        
+        monkeypatch.setattr(jwt, "decode", fail_decode)
+        return token, payload
+    
+    def test_cached_token_past_exp_is_rejected(self, memory_security, monkeypatch):
+        """Test a cache hit still enforces exp"""
+        import time
+        import jwt
+        from fastapi import HTTPException
+        
+        token, payload = self._cached_token(memory_security, monkeypatch)
+        monkeypatch.setattr(time, "time", lambda: payload["exp"] + 1)
+        
+        with pytest.raises(jwt.ExpiredSignatureError):
+            memory_security._verify_signature_cached(token)
+        
+        with pytest.raises(HTTPException) as exc_info:
+            memory_security.verify_jwt_token(token)
+        assert exc_info.value.detail == "Token has expired"
+    
+    def test_cached_token_blacklisted_is_rejected(self, memory_security, monkeypatch):
+        """Test a cache hit still checks the blacklist"""
+        from fastapi import HTTPException
+        
+        token, payload = self._cached_token(memory_security, monkeypatch)
+        memory_security.token_blacklist[payload["jti"]] = payload["exp"]
+        
+        with pytest.raises(HTTPException) as exc_info:
+            memory_security.verify_jwt_token(token)
+        assert exc_info.value.detail == "Token has been revoked"
+
+    def test_cached_payload_is_not_shared(self, memory_security):
+        """Test mutating a returned payload does not affect later cache hits"""
+        token = issue_token(memory_security)
+        
+        payload = memory_security.verify_jwt_token(token)
+        payload["role"] = "admin"
+        
+        assert memory_security.verify_jwt_token(token)["role"] == TEST_USER["role"]
+    
+    @pytest.mark.parametrize("missing_claim", ["exp", "jti"])
+    def test_token_missing_required_claim_is_401(self, memory_security, missing_claim):
+        """Test signed tokens without exp or jti are rejected up front"""
+        import time
+        import jwt
+        from fastapi import HTTPException
+        
+        claims = {
+            "user_id": "test_id",
+            "email": TEST_USER["email"],
+            "role": TEST_USER["role"],
+            "exp": int(time.time()) + 3600,
+            "jti": "test_jti",
+            "iss": "supply-chain-ai",
+            "aud": "supply-chain-ai-frontend"
+        }
+        del claims[missing_claim]
+        token = jwt.encode(claims, os.environ["JWT_SECRET"], algorithm="HS256")
+        
+        for _ in range(2):
+            with pytest.raises(HTTPException) as exc_info:
+                memory_security.verify_jwt_token(token)
+            assert exc_info.value.status_code == 401
+
+@pytest.fixture
+def app_security(memory_security):
+    """Fresh in-memory security manager wired into the app"""
+    from main import get_security_manager
+    
+    app.dependency_overrides[get_security_manager] = lambda: memory_security
+    yield memory_security
+    app.dependency_overrides.clear()
+
+class TestVerifyTokenEndpoint:
+    """Test tokens end to end through /api/auth/verify-token"""
+    
+    def _verify(self, token: str):
+        return client.get(
+            "/api/auth/verify-token",
+            headers={"Authorization": f"Bearer {token}"}
+        )
+    
+    def test_issued_token_is_accepted(self, app_security):
+        """Test a token from create_jwt_token verifies"""
+        response = self._verify(issue_token(app_security))
+        assert response.status_code == 200
+        data = response.json()
+        assert data["success"] is True
+        assert data["user"]["id"] == "test_id"
+    
+    def test_legacy_token_is_rejected(self, app_security):
+        """Test a token without iss, aud and jti gets 401"""
+        import time
+        import jwt
+        
+        now = int(time.time())
+        legacy = jwt.encode({
+            "user_id": "test_id",
+            "email": TEST_USER["email"],
+            "role": TEST_USER["role"],
+            "exp": now + 3600,
+            "iat": now
+        }, os.environ["JWT_SECRET"], algorithm="HS256")
+        
+        response = self._verify(legacy)
+        assert response.status_code == 401
+    
+    def test_blacklisted_token_is_rejected(self, app_security):
+        """Test a revoked token gets 401"""
+        token = issue_token(app_security)
+        app_security.blacklist_token(token)
+        
+        response = self._verify(token)
+        assert response.status_code == 401
+        assert response.json()["detail"] == "Token has been revoked"
+
+class StubUsersCollection:
+    """Async stand-in for the Motor users collection"""
+    
+    def __init__(self, user: Optional[dict]):
+        self.user = user
+        self.lookups = 0
+        self.updates = []
+        self.queries = []
+    
+    async def find_one(self, filter, projection=None):
+        self.queries.append(filter)
+        return dict(self.user) if self.user else None
+    
+    async def find_one_and_update(self, filter, update, **kwargs):
+        self.lookups += 1
+        self.updates.append(("find_one_and_update", filter, update))
+        return dict(self.user)
+    
+    async def update_one(self, filter, update, **kwargs):
+        self.updates.append(("update_one", filter, update))
+        return None
+
+class StubDatabaseManager:
+    """Database manager exposing only a stub users collection"""
+    
+    def __init__(self, users_collection):
+        self.client = None
+        self.users_collection = users_collection
+
+@pytest.fixture
+def login_stubs():
+    """Fresh security manager and stub database wired into the app"""
+    import bcrypt
+    from bson import ObjectId
+    from config.security import SecurityManager
+    from main import get_db_manager, get_security_manager
+    
+    manager = SecurityManager()
+    users = StubUsersCollection({
+        "_id": ObjectId(),
+        "email": TEST_USER["email"],
+        "name": TEST_USER["name"],
+        "role": TEST_USER["role"],
+        "password_hash": bcrypt.hashpw(
+            TEST_USER["password"].encode('utf-8'), bcrypt.gensalt(rounds=4)
+        ).decode('utf-8')
+    })
+    
+    bcrypt_calls = []
+    verify_password_async = manager.verify_password_async
+    
+    async def counting_verify(password, hashed):
+        bcrypt_calls.append(password)
+        return await verify_password_async(password, hashed)
+    
+    manager.verify_password_async = counting_verify
+    
+    app.dependency_overrides[get_security_manager] = lambda: manager
+    app.dependency_overrides[get_db_manager] = lambda: StubDatabaseManager(users)
+    yield users, bcrypt_calls
+    app.dependency_overrides.clear()
+
+class TestLoginCredentialCache:
+    """Test the negative cache for failed logins"""
+    
+    def test_repeated_bad_credentials_skip_lookup_and_bcrypt(self, login_stubs):
+        """Test a repeated wrong password skips DB lookup and bcrypt"""
+        users, bcrypt_calls = login_stubs
+        bad_login = {"email": TEST_USER["email"], "password": "wrongpassword"}
+        
+        for _ in range(3):
+            response = client.post("/api/auth/login", json=bad_login)
+            assert response.status_code == 200
+            assert response.json()["success"] is False
+        
+        assert users.lookups == 1
+        assert len(bcrypt_calls) == 1
+    
+    def test_correct_password_succeeds_after_bad_attempt(self, login_stubs):
+        """Test a cached bad pair does not block the right password"""
+        users, bcrypt_calls = login_stubs
+        
+        response = client.post("/api/auth/login", json={
+            "email": TEST_USER["email"],
+            "password": "wrongpassword"
+        })
+        assert response.json()["success"] is False
+        
+        response = client.post("/api/auth/login", json={
+            "email": TEST_USER["email"],
+            "password": TEST_USER["password"]
+        })
+        data = response.json()
+        assert data["success"] is True
+        assert data["token"]
+        assert users.lookups == 2
+        assert len(bcrypt_calls) == 2
+
+    def test_failed_login_writes_only_the_lookup_stamp(self, login_stubs):
+        """Test a wrong password costs one write: the last_login stamp"""
+        users, bcrypt_calls = login_stubs
+        
+        response = client.post("/api/auth/login", json={
+            "email": TEST_USER["email"],
+            "password": "wrongpassword"
+        })
+        assert response.json()["success"] is False
+        
+        assert len(users.updates) == 1
+        method, filter, update = users.updates[0]
+        assert method == "find_one_and_update"
+        assert filter == {"email": TEST_USER["email"], "is_active": True}
+        assert "last_login" in update["$set"]
+
+class TestRefreshToken:
+    """Test /api/auth/refresh-token looks users up by ObjectId"""
+    
+    def _refresh(self, manager, user: Optional[dict], user_id: str):
+        """Call refresh-token with stub managers, returning response and queries"""
+        from main import get_db_manager, get_security_manager
+        
+        users = StubUsersCollection(user)
+        app.dependency_overrides[get_security_manager] = lambda: manager
+        app.dependency_overrides[get_db_manager] = lambda: StubDatabaseManager(users)
+        try:
+            response = client.get(
+                "/api/auth/refresh-token",
+                headers={"Authorization": f"Bearer {issue_token(manager, user_id)}"}
+            )
+        finally:
+            app.dependency_overrides.clear()
+        return response, users.queries
+    
+    def test_valid_user_id_is_queried_as_object_id(self, memory_security):
+        """Test the token's user_id is converted to an ObjectId"""
+        from bson import ObjectId
+        
+        user_id = ObjectId()
+        response, queries = self._refresh(memory_security, {
+            "_id": user_id,
+            "email": TEST_USER["email"],
+            "name": TEST_USER["name"],
+            "role": TEST_USER["role"]
+        }, str(user_id))
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert data["success"] is True
+        assert memory_security.verify_jwt_token(data["token"])["user_id"] == str(user_id)
+        assert queries == [{"_id": user_id, "is_active": True}]
+    
+    def test_malformed_user_id_is_401(self, memory_security):
+        """Test a user_id that is not an ObjectId gets 401, not 500"""
+        response, queries = self._refresh(memory_security, None, "test_id")
+        
+        assert response.status_code == 401
+        assert queries == []
+    
+    def test_inactive_user_is_401(self, memory_security):
+        """Test a user filtered out by is_active gets 401"""
+        from bson import ObjectId
+        
+        response, queries = self._refresh(memory_security, None, str(ObjectId()))
+        
+        assert response.status_code == 401
+        assert response.json()["detail"] == "User not found or inactive"
+        assert len(queries) == 1
+
 class TestRateLimiting:
     """Test rate limiting functionality"""
     
@@ -119,6 +499,216 @@ class TestRateLimiting:
         # Should block requests over limit
         assert security_manager.check_rate_limit(identifier, limit, window) is False
 
+    def test_fast_rate_limiting_logic(self, monkeypatch):
+        """Test fixed-window rate limiting logic"""
+        import time
+        import uuid
+        from config.security import security_manager
+        
+        # Freeze time mid-bucket so all calls land in the same window
+        monkeypatch.setattr(time, "time", lambda: 1_000_000.0)
+        
+        identifier = f"test_client_fast:{uuid.uuid4()}"
+        limit = 5
+        window = 60
+        
+        for i in range(limit):
+            assert security_manager.check_rate_limit_fast(identifier, limit, window) is True
+        
+        assert security_manager.check_rate_limit_fast(identifier, limit, window) is False
+    
+    def test_fast_and_sliding_fallbacks_are_separate(self, memory_security):
+        """Test in-memory fast and sliding limiters don't count each other's hits"""
+        identifier = "5.6.7.8"
+        
+        for i in range(5):
+            assert memory_security.check_rate_limit_fast(identifier, 1000, 60) is True
+        
+        for i in range(5):
+            assert memory_security.check_rate_limit(identifier, 5, 60) is True
+        assert memory_security.check_rate_limit(identifier, 5, 60) is False
+        
+        assert memory_security.check_rate_limit_fast(identifier, 1000, 60) is True
+
+    def test_memory_window_expiry(self, memory_security):
+        """Test old timestamps leave the in-memory window"""
+        check = memory_security._check_rate_limit_memory
+        
+        for i in range(3):
+            assert check("expiry_client", 3, 10, 1000.0 + i) is True
+        assert check("expiry_client", 3, 10, 1005.0) is False
+        
+        # First request falls out of the window, the other two remain
+        assert check("expiry_client", 3, 10, 1010.0) is True
+        assert check("expiry_client", 3, 10, 1010.5) is False
+        
+        # Whole window elapsed
+        for i in range(3):
+            assert check("expiry_client", 3, 10, 1030.0 + i) is True
+    
+    def test_memory_limit_change_keeps_history(self, memory_security):
+        """Test changing the limit rebuilds the ring buffer without losing entries"""
+        check = memory_security._check_rate_limit_memory
+        
+        for i in range(2):
+            assert check("resize_client", 2, 60, 1000.0 + i) is True
+        assert check("resize_client", 2, 60, 1002.0) is False
+        
+        # Larger limit: the two earlier requests still count
+        for i in range(3):
+            assert check("resize_client", 5, 60, 1003.0 + i) is True
+        assert check("resize_client", 5, 60, 1006.0) is False
+        
+        # Smaller limit again: the most recent entries are kept
+        assert check("resize_client", 2, 60, 1007.0) is False
+    
+    def test_memory_history_outlives_an_hour_for_long_windows(self, memory_security):
+        """Test day-scale limits keep their history while idle"""
+        import time
+        
+        now = time.time()
+        check = memory_security._check_rate_limit_memory
+        
+        for i in range(3):
+            assert check("daily_client", 3, 86400, now) is True
+        assert check("daily_client", 3, 86400, now) is False
+        
+        # Idle for more than an hour, well inside the window
+        memory_security.rate_limit_cache.expire(now + 3700)
+        assert check("daily_client", 3, 86400, now + 3700) is False
+        
+        # Entry is evicted only once the window has passed
+        memory_security.rate_limit_cache.expire(now + 3700 + 86401)
+        assert "daily_client" not in memory_security.rate_limit_cache
+    
+    def test_block_cache_is_scoped_per_limiter(self, redis_security):
+        """Test one exhausted limiter does not block other limits on the identifier"""
+        identifier = "1.2.3.4"
+        
+        for i in range(5):
+            assert redis_security.check_rate_limit(identifier, 5, 60) is True
+        assert redis_security.check_rate_limit(identifier, 5, 60) is False
+        
+        # Blocked locally for this limiter only
+        assert redis_security.check_rate_limit(identifier, 5, 60) is False
+        assert redis_security.check_rate_limit_fast(identifier, 1000, 60) is True
+        assert redis_security.check_rate_limit(identifier, 100, 60) is True
+
+class TestRequestCheck:
+    """Test combined token, blacklist and rate-limit checks"""
+    
+    @pytest.mark.parametrize("manager_fixture", ["redis_security", "memory_security"])
+    def test_rate_limit_exceeded(self, manager_fixture, request):
+        """Test requests over the limit get 429"""
+        from fastapi import HTTPException
+        
+        manager = request.getfixturevalue(manager_fixture)
+        token = issue_token(manager)
+        
+        for i in range(3):
+            assert manager.check_request(token, "9.9.9.9", 3, 60)["email"] == TEST_USER["email"]
+        
+        with pytest.raises(HTTPException) as exc_info:
+            manager.check_request(token, "9.9.9.9", 3, 60)
+        assert exc_info.value.status_code == 429
+    
+    @pytest.mark.parametrize("manager_fixture", ["redis_security", "memory_security"])
+    def test_revoked_token_is_401_and_not_counted(self, manager_fixture, request):
+        """Test revoked tokens get 401 without using the caller's quota"""
+        from fastapi import HTTPException
+        
+        manager = request.getfixturevalue(manager_fixture)
+        revoked = issue_token(manager)
+        manager.blacklist_token(revoked)
+        
+        for i in range(5):
+            with pytest.raises(HTTPException) as exc_info:
+                manager.check_request(revoked, "9.9.9.9", 3, 60)
+            assert exc_info.value.status_code == 401
+            assert exc_info.value.detail == "Token has been revoked"
+        
+        # Full quota still available to a valid token
+        token = issue_token(manager)
+        for i in range(3):
+            manager.check_request(token, "9.9.9.9", 3, 60)
+    
+    @pytest.mark.parametrize("manager_fixture", ["redis_security", "memory_security"])
+    def test_revoked_token_is_401_while_rate_limited(self, manager_fixture, request):
+        """Test revocation wins over a locally cached rate-limit block"""
+        from fastapi import HTTPException
+        
+        manager = request.getfixturevalue(manager_fixture)
+        token = issue_token(manager)
+        
+        for i in range(3):
+            manager.check_request(token, "9.9.9.9", 3, 60)
+        with pytest.raises(HTTPException):
+            manager.check_request(token, "9.9.9.9", 3, 60)
+        
+        manager.blacklist_token(token)
+        with pytest.raises(HTTPException) as exc_info:
+            manager.check_request(token, "9.9.9.9", 3, 60)
+        assert exc_info.value.status_code == 401
+
+class StubAdminDatabase:
+    """Admin database whose serverStatus is refused, as without clusterMonitor"""
+    
+    def __init__(self):
+        self.server_status_calls = 0
+    
+    async def command(self, name):
+        from pymongo.errors import OperationFailure
+        
+        self.server_status_calls += 1
+        raise OperationFailure("not authorized on admin", code=13)
+
+class StubMongoClient:
+    """Async stand-in for the Motor client used by get_connection_info"""
+    
+    def __init__(self):
+        self.admin = StubAdminDatabase()
+    
+    async def server_info(self):
+        return {"version": "7.0.0"}
+
+class StubDatabase:
+    """Async stand-in for the Motor database"""
+    
+    name = "test_db"
+    
+    async def command(self, name):
+        return {"dataSize": 2 * 1024 * 1024}
+
+class StubCountingCollection:
+    """Async stand-in for the users collection counting documents"""
+    
+    name = "users"
+    
+    async def count_documents(self, filter):
+        return 3
+
+class TestConnectionInfo:
+    """Test connection info degrades when serverStatus is not authorized"""
+    
+    def test_unauthorized_server_status_keeps_other_stats(self):
+        """Test server_connections falls back to N/A and is not retried per call"""
+        from config.database import DatabaseManager
+        
+        manager = DatabaseManager()
+        manager.client = StubMongoClient()
+        manager.db = StubDatabase()
+        manager.users_collection = StubCountingCollection()
+        
+        for _ in range(2):
+            info = asyncio.run(manager.get_connection_info())
+            assert "error" not in info
+            assert info["server_version"] == "7.0.0"
+            assert info["user_count"] == 3
+            assert info["database_size_mb"] == 2.0
+            assert info["server_connections"] == "N/A"
+        
+        assert manager.client.admin.server_status_calls == 1
+
 class TestEnvironmentConfig:
     """Test environment configuration"""
     